@@ -4,21 +4,67 @@ Script to search for dependencies and find which projects use them.
 """
 
 import argparse
+import asyncio
+import gzip
+import hashlib
 import json
+import logging
 import os
+import re
 import stat
 import sys
+import threading
 import csv
 import urllib.parse
+from collections import defaultdict
 from datetime import datetime
 from dotenv import load_dotenv
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Fall back to stdlib json when orjson is unavailable
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Per-result detail is logged at DEBUG (enabled with -v) so bulk result sets
+# don't pay one stdio write per row
+logger = logging.getLogger(__name__)
+
 # Configuration
 API_URL = 'https://api.endorlabs.com/v1'
+MAX_CONCURRENT_REQUESTS = 8
+# Rows per page; the server clamps to its own maximum if lower
+PAGE_SIZE = 500
+# Dependencies OR'd into a single query filter; chunked to stay under
+# server-side filter-length limits
+DEPENDENCY_CHUNK_SIZE = 25
+# Output files buffer 1 MiB before hitting the kernel, so large CSV/JSONL
+# writes coalesce into few write() syscalls
+WRITE_BUFFER_SIZE = 1 << 20
+# Shared read-only sentinel for absent dicts in the hot object loop;
+# .get(key) or _EMPTY avoids allocating a fresh {} default per lookup
+_EMPTY = {}
+# Fixed schema of the result rows built in the query loop
+RESULT_FIELDS = (
+    "namespace_fqdn",
+    "namespace",
+    "searched_dependency",
+    "project_name",
+    "project_uuid",
+    "dependency_name",
+    "dependency_version",
+    "dependency_scope",
+    "parent_package_version_name",
+)
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 0.5
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
 
 def get_env_values():
     """Get necessary values from environment variables."""
@@ -38,23 +84,76 @@ def get_env_values():
     }
 
 TOKEN_REFRESH_MARGIN_SECONDS = 60
+TOKEN_CACHE_PATH = os.path.expanduser("~/.endor_token.json")
 
 
 class TokenManager:
-    """Handles API token lifecycle: fetch, cache, and auto-refresh before expiry."""
+    """
+    Handles API token lifecycle: fetch, cache, and auto-refresh before expiry.
+    Tokens are persisted to TOKEN_CACHE_PATH (owner-only) so repeated CLI
+    invocations skip the login round trip while the token is still valid.
+    """
 
     def __init__(self, api_key, api_secret):
         self._api_key = api_key
         self._api_secret = api_secret
         self._token = None
         self._expires_at = 0
+        # Serializes refreshes when several tasks hit expiry at once
+        self._refresh_lock = threading.Lock()
+        # Pooled session so refreshes reuse the TLS connection, with
+        # retry/backoff handled at the adapter level
+        self._session = requests.Session()
+        self._session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=16,
+                pool_maxsize=32,
+                max_retries=Retry(
+                    total=5,
+                    backoff_factor=RETRY_BACKOFF_SECONDS,
+                    status_forcelist=sorted(RETRYABLE_STATUS_CODES),
+                    allowed_methods=frozenset({"POST"}),
+                ),
+            ),
+        )
+
+    def _key_hash(self):
+        return hashlib.sha256(self._api_key.encode()).hexdigest()
+
+    def _load_cached_token(self):
+        """Adopt a previously persisted token if it matches this key and is fresh."""
+        import time as _time
+        try:
+            with open(TOKEN_CACHE_PATH) as f:
+                cached = json.load(f)
+            if (
+                cached.get("key_hash") == self._key_hash()
+                and cached.get("token")
+                and cached.get("exp", 0) - _time.time() > TOKEN_REFRESH_MARGIN_SECONDS
+            ):
+                self._token = cached["token"]
+                self._expires_at = int(cached["exp"])
+        except (OSError, ValueError, TypeError):
+            pass  # Missing/corrupt cache — fall through to a fresh login
+
+    def _store_cached_token(self):
+        try:
+            cached = {
+                "token": self._token,
+                "exp": self._expires_at,
+                "key_hash": self._key_hash(),
+            }
+            _write_file_restricted(TOKEN_CACHE_PATH, lambda f: json.dump(cached, f))
+        except OSError:
+            pass  # Cache write is best-effort
 
     def _fetch_token(self):
         url = f"{API_URL}/auth/api-key"
         payload = {"key": self._api_key, "secret": self._api_secret}
         headers = {"Content-Type": "application/json", "Request-Timeout": "60"}
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=600)
+            response = self._session.post(url, json=payload, headers=headers, timeout=600)
             response.raise_for_status()
             data = response.json()
             self._token = data.get("token")
@@ -79,41 +178,97 @@ class TokenManager:
             print(f"Failed to get token: {type(e).__name__}")
             sys.exit(1)
 
-    @property
-    def token(self):
+    def _needs_refresh(self):
         import time as _time
-        if (
+        return (
             self._token is None
             or _time.time() >= self._expires_at - TOKEN_REFRESH_MARGIN_SECONDS
-        ):
-            self._fetch_token()
-        return self._token
+        )
+
+    @property
+    def token(self):
+        with self._refresh_lock:
+            if self._token is None:
+                self._load_cached_token()
+            if self._needs_refresh():
+                self._fetch_token()
+                self._store_cached_token()
+            return self._token
+
+    async def token_async(self):
+        """
+        Token for use inside the event loop: the common still-valid case is a
+        plain attribute read, and the occasional blocking refresh runs on the
+        default executor thread pool so it doesn't stall concurrent requests.
+        """
+        if not self._needs_refresh():
+            return self._token
+        return await asyncio.to_thread(lambda: self.token)
+
+
+async def _request_json(session, semaphore, token_mgr, method, url, **kwargs):
+    """
+    Issue a request on the shared ClientSession under the concurrency semaphore,
+    retrying 429/5xx responses with exponential backoff. Returns the parsed JSON
+    body; raises aiohttp.ClientError after retries are exhausted.
+    """
+    for attempt in range(MAX_RETRIES):
+        headers = {
+            "Authorization": f"Bearer {await token_mgr.token_async()}",
+            "Content-Type": "application/json",
+            "Request-Timeout": "600",
+        }
+        async with semaphore:
+            response = await session.request(
+                method,
+                url,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=600),
+                **kwargs,
+            )
+            async with response:
+                if (
+                    response.status in RETRYABLE_STATUS_CODES
+                    and attempt < MAX_RETRIES - 1
+                ):
+                    retry_after = RETRY_BACKOFF_SECONDS * (2 ** attempt)
+                else:
+                    response.raise_for_status()
+                    body = await response.read()
+                    # orjson's Rust parser is several times faster than stdlib
+                    # on the large QUERY API payloads
+                    if orjson is not None:
+                        return orjson.loads(body)
+                    return json.loads(body)
+        await asyncio.sleep(retry_after)
+
+
+def _request_error_detail(e):
+    """Status code for HTTP errors, otherwise the stringified exception."""
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status
+    return str(e)
+
+
+# One-pass parse/validation of ecosystem://dependency@version; the version is
+# everything after the last '@' and must be non-empty, as must the ecosystem
+_DEPENDENCY_RE = re.compile(
+    r"^(?P<ecosystem>[^:]+)://(?P<dependency>.+)@(?P<version>[^@]+)$"
+)
 
 
 def parse_dependency(dependency_str):
     """Parse dependency string in format ecosystem://dependency@version."""
-    try:
-        if '://' not in dependency_str:
-            raise ValueError("Invalid format: missing '://'")
-        
-        ecosystem, rest = dependency_str.split('://', 1)
-        
-        if '@' not in rest:
-            raise ValueError("Invalid format: missing '@' for version")
-        
-        dependency, version = rest.rsplit('@', 1)
-        
-        return {
-            'ecosystem': ecosystem,
-            'dependency': dependency,
-            'version': version,
-            'full_name': f"{ecosystem}://{dependency}"
-        }
-    except Exception as e:
-        print(f"Error parsing dependency '{dependency_str}': {e}")
+    match = _DEPENDENCY_RE.match(dependency_str)
+    if not match:
+        print(f"Error parsing dependency '{dependency_str}': invalid format")
         print("Expected format: ecosystem://dependency@version")
         return None
 
+    info = match.groupdict()
+    info['full_name'] = f"{info['ecosystem']}://{info['dependency']}"
+    return info
+
 
 def _namespace_in_subtree(fqn, root_namespace):
     return fqn == root_namespace or fqn.startswith(root_namespace + ".")
@@ -143,7 +298,7 @@ def _namespace_fqn_from_list_object(obj, root_namespace):
     return None
 
 
-def collect_namespace_fqdns(token_mgr, root_namespace):
+async def collect_namespace_fqdns(session, semaphore, token_mgr, root_namespace):
     """
     List fully qualified namespace names under root_namespace (ListNamespaces API,
     subtree traverse). Shown for reference before the dependency query.
@@ -155,18 +310,14 @@ def collect_namespace_fqdns(token_mgr, root_namespace):
     while True:
         params = {
             "list_parameters.traverse": "true",
-            "list_parameters.page_size": "500",
+            "list_parameters.page_size": str(PAGE_SIZE),
         }
         if next_page_token is not None:
             params["list_parameters.page_token"] = str(next_page_token)
         try:
-            headers = {
-                "Authorization": f"Bearer {token_mgr.token}",
-                "Request-Timeout": "600",
-            }
-            response = requests.get(url, headers=headers, params=params, timeout=600)
-            response.raise_for_status()
-            data = response.json()
+            data = await _request_json(
+                session, semaphore, token_mgr, "GET", url, params=params
+            )
             lst = _parse_list_response_body(data)
             for obj in lst.get("objects") or []:
                 fqn = _namespace_fqn_from_list_object(obj, root_namespace)
@@ -175,8 +326,8 @@ def collect_namespace_fqdns(token_mgr, root_namespace):
             next_page_token = (lst.get("response") or {}).get("next_page_token")
             if not next_page_token:
                 break
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to list namespaces under {root_namespace!r}: {type(e).__name__}: {e.response.status_code if hasattr(e, 'response') and e.response is not None else str(e)}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Failed to list namespaces under {root_namespace!r}: {type(e).__name__}: {_request_error_detail(e)}")
             break
 
     rest = sorted(ns for ns in discovered if ns != root_namespace)
@@ -190,230 +341,405 @@ def collect_namespace_fqdns(token_mgr, root_namespace):
     return ordered
 
 
-def _query_dependency_in_namespace(token_mgr, namespace_fqdn, dependency_info):
+def _batch_filter(dependency_chunk):
+    """OR together one (package_name, resolved_version) clause per dependency."""
+    clauses = " or ".join(
+        f"(spec.dependency_data.package_name=={dep['full_name']} and "
+        f"spec.dependency_data.resolved_version=={dep['version']})"
+        for dep in dependency_chunk
+    )
+    return f"context.type==CONTEXT_TYPE_MAIN and ({clauses})"
+
+
+def _build_query_payload(dependency_chunk, page_token=None, count_only=False):
     """
-    POST .../namespaces/{namespace_fqdn}/queries for DependencyMetadata (no traverse).
-    Project join also without traverse — scoped to the same namespace.
+    Fresh query body per page, so in-flight requests never share state.
+    count_only bodies skip the mask and the Project join — the server only
+    needs to count matching rows, not materialize them.
     """
-    encoded = urllib.parse.quote(namespace_fqdn, safe="")
-    url = f"{API_URL}/namespaces/{encoded}/queries"
+    list_parameters = {
+        "filter": _batch_filter(dependency_chunk),
+    }
+    if count_only:
+        list_parameters["count_only"] = True
+    else:
+        list_parameters["page_size"] = PAGE_SIZE
+        # Only the fields the result rows consume; meta.references
+        # carries the Project join output
+        list_parameters["mask"] = (
+            "meta.references,"
+            "spec.dependency_data.package_name,"
+            "spec.dependency_data.resolved_version,"
+            "spec.dependency_data.scope,"
+            "spec.importer_data.project_uuid,"
+            "spec.importer_data.package_version_name"
+        )
+    if page_token:
+        list_parameters["page_token"] = page_token
 
-    query_payload = {
-        "meta": {
-            "name": f"Dependencies with Project Info: {dependency_info['full_name']}"
-        },
-        "spec": {
-            "query_spec": {
-                "kind": "DependencyMetadata",
-                "list_parameters": {
-                    "filter": (
-                        f"context.type==CONTEXT_TYPE_MAIN and "
-                        f"spec.dependency_data.package_name=={dependency_info['full_name']} and "
-                        f"spec.dependency_data.resolved_version=={dependency_info['version']}"
-                    ),
-                    "mask": "meta.name,spec.dependency_data,spec.importer_data",
+    query_spec = {
+        "kind": "DependencyMetadata",
+        "list_parameters": list_parameters,
+    }
+    if not count_only:
+        query_spec["references"] = [
+            {
+                "connect_from": "spec.importer_data.project_uuid",
+                "connect_to": "uuid",
+                "query_spec": {
+                    "kind": "Project",
+                    "list_parameters": {
+                        "mask": "uuid,meta.name",
+                    },
                 },
-                "references": [
-                    {
-                        "connect_from": "spec.importer_data.project_uuid",
-                        "connect_to": "uuid",
-                        "query_spec": {
-                            "kind": "Project",
-                            "list_parameters": {
-                                "mask": "uuid,meta.name",
-                            },
-                        },
-                    }
-                ],
             }
+        ]
+    return {
+        "meta": {
+            "name": f"Dependencies with Project Info: {len(dependency_chunk)} dependencies"
         },
+        "spec": {"query_spec": query_spec},
     }
 
+
+def _dependency_chunks(dependencies):
+    return [
+        dependencies[i : i + DEPENDENCY_CHUNK_SIZE]
+        for i in range(0, len(dependencies), DEPENDENCY_CHUNK_SIZE)
+    ]
+
+
+async def _query_dependencies_in_namespace(
+    session, semaphore, token_mgr, namespace_fqdn, dependency_chunk, writer
+):
+    """
+    POST .../namespaces/{namespace_fqdn}/queries for DependencyMetadata (no traverse),
+    matching every dependency in the chunk with a single OR'd filter.
+    Project join also without traverse — scoped to the same namespace.
+    Each page is streamed to `writer` as soon as it is parsed.
+
+    Page tokens are opaque, so pages cannot be fetched fully in parallel;
+    instead the next page's POST is started as soon as the current body is
+    parsed, overlapping row processing with the next network round trip.
+    """
+    encoded = urllib.parse.quote(namespace_fqdn, safe="")
+    url = f"{API_URL}/namespaces/{encoded}/queries"
+
     results = []
-    next_page_token = None
     page_num = 1
 
-    while True:
-        if next_page_token:
-            query_payload["spec"]["query_spec"]["list_parameters"][
-                "page_token"
-            ] = next_page_token
+    # Flyweight for the low-cardinality string fields: one str object per
+    # unique value instead of one per row. project_uuid stays uninterned
+    # (high cardinality); namespace is already the single namespace_fqdn str.
+    intern_cache = {}
 
-        try:
-            print(f"  Page {page_num}...")
-            headers = {
-                "Authorization": f"Bearer {token_mgr.token}",
-                "Content-Type": "application/json",
-                "Request-Timeout": "600",
-            }
-            response = requests.post(url, headers=headers, json=query_payload, timeout=600)
-            response.raise_for_status()
+    def intern(value):
+        return intern_cache.setdefault(value, value) if value else value
 
-            data = response.json()
-            query_response = data.get("spec", {}).get("query_response", {})
-            objects = query_response.get("list", {}).get("objects", [])
-            print(f"  Received {len(objects)} row(s) on page {page_num}")
-
-            for obj in objects:
-                dep_data = obj.get("spec", {}).get("dependency_data", {})
-                importer_data = obj.get("spec", {}).get("importer_data", {})
-
-                project_name = ""
-                meta_refs = obj.get("meta", {}).get("references", {})
-                if "Project" in meta_refs:
-                    project_objects = (
-                        meta_refs["Project"].get("list", {}).get("objects", [])
-                    )
-                    if project_objects:
-                        project_name = (
-                            project_objects[0].get("meta", {}).get("name", "")
-                        )
-
-                result = {
-                    "namespace_fqdn": namespace_fqdn,
-                    "namespace": namespace_fqdn,
-                    "project_uuid": importer_data.get("project_uuid", ""),
-                    "project_name": project_name,
-                    "dependency_name": dep_data.get("package_name", ""),
-                    "dependency_version": dep_data.get("resolved_version", ""),
-                    "dependency_scope": dep_data.get("scope", ""),
-                    "parent_package_version_name": importer_data.get(
-                        "package_version_name", ""
-                    ),
-                }
-                results.append(result)
-                print(
-                    f"    Found {result['dependency_name']}@{result['dependency_version']} "
-                    f"in {result['project_name']} ({result['project_uuid']}) "
-                    f"[namespace={namespace_fqdn}]"
+    try:
+        data = await _request_json(
+            session, semaphore, token_mgr, "POST", url,
+            json=_build_query_payload(dependency_chunk),
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"  Failed querying {namespace_fqdn!r}: {type(e).__name__}: {_request_error_detail(e)}")
+        return results
+
+    while True:
+        query_response = data.get("spec", {}).get("query_response", {})
+        objects = query_response.get("list", {}).get("objects", [])
+        next_page_token = query_response.get("list", {}).get("response", {}).get(
+            "next_page_token"
+        )
+
+        # Kick off the next fetch before processing this page's rows
+        next_page_task = None
+        if next_page_token:
+            next_page_task = asyncio.create_task(
+                _request_json(
+                    session, semaphore, token_mgr, "POST", url,
+                    json=_build_query_payload(dependency_chunk, next_page_token),
+                )
+            )
+            # Yield once so the task issues its POST before the (synchronous)
+            # row processing below starts
+            await asyncio.sleep(0)
+
+        page_results = []
+        for obj in objects:
+            spec = obj.get("spec") or _EMPTY
+            meta = obj.get("meta") or _EMPTY
+            dep_data = spec.get("dependency_data") or _EMPTY
+            importer_data = spec.get("importer_data") or _EMPTY
+
+            parent = importer_data.get("package_version_name", "")
+            project_name = ""
+            meta_refs = meta.get("references") or _EMPTY
+            if "Project" in meta_refs:
+                project_objects = (
+                    (meta_refs["Project"].get("list") or _EMPTY).get("objects")
                 )
-                if result["parent_package_version_name"]:
-                    print(
-                        f"      └── Parent package version: "
-                        f"{result['parent_package_version_name']}"
+                if project_objects:
+                    project_name = (
+                        (project_objects[0].get("meta") or _EMPTY).get("name", "")
                     )
 
-            query_response = data.get("spec", {}).get("query_response", {})
-            next_page_token = query_response.get("list", {}).get("response", {}).get(
-                "next_page_token"
+            result = {
+                "namespace_fqdn": namespace_fqdn,
+                "namespace": namespace_fqdn,
+                "project_uuid": importer_data.get("project_uuid", ""),
+                "project_name": intern(project_name),
+                "dependency_name": intern(dep_data.get("package_name", "")),
+                "dependency_version": intern(dep_data.get("resolved_version", "")),
+                "dependency_scope": intern(dep_data.get("scope", "")),
+                "parent_package_version_name": intern(parent),
+            }
+            page_results.append(result)
+            logger.debug(
+                "    Found %s@%s in %s (%s) [namespace=%s]",
+                result["dependency_name"],
+                result["dependency_version"],
+                result["project_name"],
+                result["project_uuid"],
+                namespace_fqdn,
             )
-            if not next_page_token:
-                break
+            if parent:
+                logger.debug("      └── Parent package version: %s", parent)
 
-            page_num += 1
+        writer.write_rows(page_results)
+        results.extend(page_results)
+        print(
+            f"  [{namespace_fqdn}] page {page_num}: {len(objects)} row(s) "
+            f"(cumulative {len(results)})"
+        )
 
-        except requests.exceptions.RequestException as e:
-            print(f"  Failed querying {namespace_fqdn!r}: {type(e).__name__}: {e.response.status_code if hasattr(e, 'response') and e.response is not None else str(e)}")
+        if next_page_task is None:
+            break
+
+        page_num += 1
+        try:
+            data = await next_page_task
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"  Failed querying {namespace_fqdn!r}: {type(e).__name__}: {_request_error_detail(e)}")
             break
 
     return results
 
 
-def search_dependency_usage(token_mgr, root_namespace, dependency_info):
+async def _count_dependencies_in_namespace(
+    session, semaphore, token_mgr, namespace_fqdn, dependency_chunk
+):
+    """Count matching DependencyMetadata rows in one namespace — no pagination."""
+    encoded = urllib.parse.quote(namespace_fqdn, safe="")
+    url = f"{API_URL}/namespaces/{encoded}/queries"
+    try:
+        data = await _request_json(
+            session, semaphore, token_mgr, "POST", url,
+            json=_build_query_payload(dependency_chunk, count_only=True),
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"  Failed counting in {namespace_fqdn!r}: {type(e).__name__}: {_request_error_detail(e)}")
+        return 0
+    query_response = (data.get("spec") or _EMPTY).get("query_response") or _EMPTY
+    response = (query_response.get("list") or _EMPTY).get("response") or _EMPTY
+    count = int(response.get("count") or 0)
+    print(f"  [{namespace_fqdn}] {count} usage(s)")
+    return count
+
+
+async def count_dependencies_batch(
+    session, semaphore, token_mgr, root_namespace, dependencies
+):
     """
-    1. ListNamespaces (subtree traverse) to discover all FQDNs.
-    2. For each FQDN, POST DependencyMetadata query with no traverse, using the
-       namespace FQDN in the URL path. Each row is tagged with that FQDN.
+    Total usage count across all namespaces under root_namespace, via
+    count_only queries: one request per namespace × chunk, no pagination,
+    no row materialization, no output files.
     """
     print(
-        f"\nSearching {dependency_info['full_name']}@{dependency_info['version']} "
+        f"\nCounting usages of {len(dependencies)} dependency(ies) "
         f"across all namespaces under {root_namespace!r}..."
     )
-    ordered_fqdns = collect_namespace_fqdns(token_mgr, root_namespace)
+    ordered_fqdns = await collect_namespace_fqdns(
+        session, semaphore, token_mgr, root_namespace
+    )
+    tasks = [
+        _count_dependencies_in_namespace(
+            session, semaphore, token_mgr, fqn, chunk
+        )
+        for fqn in ordered_fqdns
+        for chunk in _dependency_chunks(dependencies)
+    ]
+    return sum(await asyncio.gather(*tasks))
+
 
-    combined = []
+async def search_dependencies_batch(
+    session, semaphore, token_mgr, root_namespace, dependencies, writer
+):
+    """
+    1. ListNamespaces (subtree traverse) to discover all FQDNs — once for the run.
+    2. For each FQDN, POST DependencyMetadata queries with no traverse, OR-ing up
+       to DEPENDENCY_CHUNK_SIZE dependencies per query. Each row is tagged with
+       the FQDN from the URL path.
+
+    Pagination stays sequential within a query (each page needs the previous
+    next_page_token); the namespace × chunk queries overlap via asyncio.gather.
+    Returns {"<full_name>@<version>": [results]} re-bucketed by matching each
+    returned row's package_name and resolved_version to its originating dependency.
+    """
+    print(
+        f"\nSearching {len(dependencies)} dependency(ies) "
+        f"across all namespaces under {root_namespace!r}..."
+    )
+    ordered_fqdns = await collect_namespace_fqdns(
+        session, semaphore, token_mgr, root_namespace
+    )
+
+    chunks = _dependency_chunks(dependencies)
+    tasks = []
     for fqn in ordered_fqdns:
-        print(
-            f"\nQuerying DependencyMetadata in {fqn!r} — "
-            f"{dependency_info['full_name']}@{dependency_info['version']}"
-        )
-        combined.extend(
-            _query_dependency_in_namespace(token_mgr, fqn, dependency_info)
-        )
-    return combined
+        for chunk in chunks:
+            print(
+                f"Querying DependencyMetadata in {fqn!r} — "
+                f"{len(chunk)} dependency(ies)"
+            )
+            tasks.append(
+                _query_dependencies_in_namespace(
+                    session, semaphore, token_mgr, fqn, chunk, writer
+                )
+            )
+    results_per_task = await asyncio.gather(*tasks)
 
+    # Re-bucket rows to the dependency that produced them
+    dep_keys = {
+        (dep["full_name"], dep["version"]): f"{dep['full_name']}@{dep['version']}"
+        for dep in dependencies
+    }
+    all_results = {key: [] for key in dep_keys.values()}
+    for results in results_per_task:
+        for result in results:
+            key = dep_keys.get(
+                (result["dependency_name"], result["dependency_version"])
+            )
+            if key is not None:
+                all_results[key].append(result)
+    return all_results
 
-def _write_file_restricted(filename, write_fn):
-    """Write a file and set permissions to owner-only (0600)."""
+
+def _open_restricted(filename, mode="w"):
+    """Open a file for writing with owner-only (0600) permissions, 1 MiB buffered."""
     fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
     try:
-        with os.fdopen(fd, "w") as f:
-            write_fn(f)
+        return os.fdopen(fd, mode, buffering=WRITE_BUFFER_SIZE)
     except Exception:
         os.close(fd)
         raise
 
 
+def _write_file_restricted(filename, write_fn):
+    """Write a file and set permissions to owner-only (0600)."""
+    with _open_restricted(filename) as f:
+        write_fn(f)
+
+
 def save_results_json(results, filename):
-    """Save results to JSON file (owner-only permissions)."""
+    """Save the nested per-dependency results tree to JSON (owner-only, --format json)."""
+    def dump(f):
+        if orjson is not None:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+        else:
+            json.dump(results, f, indent=2)
+
     try:
-        _write_file_restricted(filename, lambda f: json.dump(results, f, indent=2))
+        _write_file_restricted(filename, dump)
         print(f"Results saved to JSON: {filename}")
     except Exception as e:
         print(f"Error saving JSON file: {e}")
 
-def save_results_csv(results, filename):
-    """Save results to CSV file (owner-only permissions)."""
-    if not results:
-        print("No results to save to CSV")
-        return
-    
-    try:
-        preferred = [
-            "namespace_fqdn",
-            "namespace",
-            "searched_dependency",
-            "project_name",
-            "project_uuid",
-            "dependency_name",
-            "dependency_version",
-            "dependency_scope",
-            "parent_package_version_name",
+
+class ResultWriter:
+    """
+    Streams result rows to CSV and gzipped JSONL files as pages arrive, so
+    output never re-buffers the full result set in memory. The CSV schema is
+    the fixed set of keys built in the query loop, precomputed rather than
+    set-unioned over all rows after the fact. Pass jsonl_filename=None to
+    skip the JSONL stream (--format json writes a nested tree at the end
+    instead).
+    """
+
+    def __init__(self, csv_filename, jsonl_filename=None, fieldnames=RESULT_FIELDS):
+        self.csv_filename = csv_filename
+        self.jsonl_filename = jsonl_filename
+        self._csv_file = _open_restricted(csv_filename, "w")
+        self._csv_writer = csv.DictWriter(self._csv_file, fieldnames=fieldnames)
+        self._csv_writer.writeheader()
+        self._jsonl_raw = None
+        self._jsonl_file = None
+        if jsonl_filename is not None:
+            self._jsonl_raw = _open_restricted(jsonl_filename, "wb")
+            self._jsonl_file = gzip.GzipFile(
+                filename="", fileobj=self._jsonl_raw, mode="wb"
+            )
+
+    def write_rows(self, rows):
+        flat_rows = [
+            {
+                **row,
+                "searched_dependency": (
+                    f"{row['dependency_name']}@{row['dependency_version']}"
+                ),
+            }
+            for row in rows
         ]
-        extras = set()
-        for result in results:
-            extras.update(result.keys())
-        fieldnames = [c for c in preferred if c in extras]
-        fieldnames.extend(sorted(c for c in extras if c not in fieldnames))
-
-        def write_csv(f):
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            for result in results:
-                writer.writerow(result)
-
-        _write_file_restricted(filename, write_csv)
-        print(f"Results saved to CSV: {filename}")
-    except Exception as e:
-        print(f"Error saving CSV file: {e}")
+        self._csv_writer.writerows(flat_rows)
+        if self._jsonl_file is not None:
+            for flat in flat_rows:
+                if orjson is not None:
+                    self._jsonl_file.write(orjson.dumps(flat))
+                else:
+                    self._jsonl_file.write(json.dumps(flat).encode())
+                self._jsonl_file.write(b"\n")
+
+    def close(self):
+        self._csv_file.close()
+        if self._jsonl_file is not None:
+            self._jsonl_file.close()
+            self._jsonl_raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 
 def display_results(results, dependency_info, root_namespace=None):
-    """Display results on terminal."""
-    print(f"\n{'='*60}")
-    print(f"SEARCH RESULTS for {dependency_info['full_name']}@{dependency_info['version']}")
-    print(f"{'='*60}")
-    
+    """Display results on terminal (built as one buffered write)."""
+    lines = [
+        f"\n{'='*60}",
+        f"SEARCH RESULTS for {dependency_info['full_name']}@{dependency_info['version']}",
+        f"{'='*60}",
+    ]
+
     if not results:
-        print("No projects found using this dependency.")
+        lines.append("No projects found using this dependency.")
+        sys.stdout.write("\n".join(lines) + "\n")
         return
-    
-    print(f"Found {len(results)} usage(s) across {len(set(r['namespace'] for r in results))} namespace(s)")
-    print()
-    
-    # Group by namespace and project
-    grouped = {}
+
+    # Group by namespace and project; the grouping keys double as the
+    # unique namespace/project counts, so no separate counting pass
+    grouped = defaultdict(lambda: defaultdict(list))
     for result in results:
         namespace = result.get("namespace") or result.get("namespace_fqdn") or ""
         project_name = result['project_name'] or 'Unknown Project'
-        project_key = f"{project_name} ({result['project_uuid']})"
-        
-        if namespace not in grouped:
-            grouped[namespace] = {}
-        if project_key not in grouped[namespace]:
-            grouped[namespace][project_key] = []
-        
-        grouped[namespace][project_key].append(result)
-    
+        grouped[namespace][f"{project_name} ({result['project_uuid']})"].append(result)
+
+    project_count = sum(len(projects) for projects in grouped.values())
+    lines.append(
+        f"Found {len(results)} usage(s) across {len(grouped)} namespace(s) "
+        f"and {project_count} project(s)"
+    )
+    lines.append("")
+
     keys = list(grouped.keys())
     if root_namespace and root_namespace in keys:
         namespace_order = [root_namespace] + sorted(k for k in keys if k != root_namespace)
@@ -422,18 +748,21 @@ def display_results(results, dependency_info, root_namespace=None):
 
     for namespace in namespace_order:
         projects = grouped[namespace]
-        print(f"Namespace: {namespace}")
+        lines.append(f"Namespace: {namespace}")
         for project_key, usages in projects.items():
-            print(f"  └── Project: {project_key}")
+            lines.append(f"  └── Project: {project_key}")
             for usage in usages:
-                print(f"      ├── Scope: {usage['dependency_scope']}")
-                if usage['parent_package_version_name']:
-                    print(f"      └── Parent package version: {usage['parent_package_version_name']}")
+                lines.append(f"      ├── Scope: {usage['dependency_scope']}")
+                parent = usage['parent_package_version_name']
+                if parent:
+                    lines.append(f"      └── Parent package version: {parent}")
                 else:
-                    print(f"      └── (No parent package version info)")
-        print()
+                    lines.append(f"      └── (No parent package version info)")
+        lines.append("")
 
-def main():
+    sys.stdout.write("\n".join(lines) + "\n")
+
+async def main():
     """Main function."""
     parser = argparse.ArgumentParser(
         description='Search for dependencies and find which projects use them.',
@@ -450,7 +779,30 @@ Examples:
         required=True, 
         help='Comma-separated list of dependencies in format: ecosystem://dependency@version'
     )
+    parser.add_argument(
+        '--count-only',
+        action='store_true',
+        help='Only count matching usages (one request per namespace, no '
+             'pagination or output files)'
+    )
+    parser.add_argument(
+        '--format',
+        choices=['jsonl', 'json'],
+        default='jsonl',
+        help='JSON output style: gzipped line-delimited records streamed during '
+             'the search (jsonl, default) or a nested tree written at the end (json)'
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Log every matched result row (default: one progress line per page)'
+    )
     args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(message)s",
+    )
     
     # Parse dependencies
     dependency_strings = [dep.strip() for dep in args.dependencies.split(',')]
@@ -463,6 +815,13 @@ Examples:
         else:
             print(f"Skipping invalid dependency: {dep_str}")
     
+    # Deduplicate by (full_name, version), preserving order — repeated inputs
+    # would otherwise bloat the batched filter and display the same results twice
+    deduped = {(d['full_name'], d['version']): d for d in dependencies}
+    if len(deduped) < len(dependencies):
+        print(f"Ignoring {len(dependencies) - len(deduped)} duplicate dependency(ies)")
+    dependencies = list(deduped.values())
+
     if not dependencies:
         print("ERROR: No valid dependencies provided.")
         sys.exit(1)
@@ -471,32 +830,56 @@ Examples:
     env = get_env_values()
     
     token_mgr = TokenManager(env["api_key"], env["api_secret"])
-    
-    # Search for each dependency
-    all_results = {}
-    
-    for dep_info in dependencies:
-        results = search_dependency_usage(token_mgr, env["initial_namespace"], dep_info)
-        all_results[f"{dep_info['full_name']}@{dep_info['version']}"] = results
-        
-        # Display results for this dependency
-        display_results(results, dep_info, env["initial_namespace"])
-    
-    # Generate output filenames
+
+    if args.count_only:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        connector = aiohttp.TCPConnector(limit=32, limit_per_host=32)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            total_usages = await count_dependencies_batch(
+                session, semaphore, token_mgr, env["initial_namespace"], dependencies
+            )
+        print(f"\n{'='*60}")
+        print(f"SUMMARY")
+        print(f"{'='*60}")
+        print(f"Dependencies searched: {len(dependencies)}")
+        print(f"Total usages found: {total_usages}")
+        return
+
+    # Generate output filenames; rows stream to the output files during
+    # pagination (--format json instead dumps the nested tree at the end)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    json_filename = f"dependency_search_results_{timestamp}.json"
     csv_filename = f"dependency_search_results_{timestamp}.csv"
-    
-    # Flatten results for CSV output (copy rows so JSON is not mutated)
-    flat_results = []
-    for dep_name, results in all_results.items():
-        for result in results:
-            flat_results.append({**result, "searched_dependency": dep_name})
-    
-    # Save results
-    save_results_json(all_results, json_filename)
-    save_results_csv(flat_results, csv_filename)
-    
+    if args.format == 'jsonl':
+        json_filename = f"dependency_search_results_{timestamp}.jsonl.gz"
+        jsonl_filename = json_filename
+    else:
+        json_filename = f"dependency_search_results_{timestamp}.json"
+        jsonl_filename = None
+
+    # Search all dependencies in batched queries over one pooled connection
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    connector = aiohttp.TCPConnector(limit=32, limit_per_host=32)
+    with ResultWriter(csv_filename, jsonl_filename) as writer:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            all_results = await search_dependencies_batch(
+                session,
+                semaphore,
+                token_mgr,
+                env["initial_namespace"],
+                dependencies,
+                writer,
+            )
+    if args.format == 'jsonl':
+        print(f"Results saved to JSONL: {jsonl_filename}")
+    else:
+        save_results_json(all_results, json_filename)
+    print(f"Results saved to CSV: {csv_filename}")
+
+    # Display results for each dependency
+    for dep_info in dependencies:
+        results = all_results[f"{dep_info['full_name']}@{dep_info['version']}"]
+        display_results(results, dep_info, env["initial_namespace"])
+
     # Summary
     total_usages = sum(len(results) for results in all_results.values())
     print(f"\n{'='*60}")
@@ -507,4 +890,4 @@ Examples:
     print(f"Results saved to: {json_filename}, {csv_filename}")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())